@@ -18,37 +18,84 @@ import unittest
 import vtk, qt, ctk, slicer
 from slicer.ScriptedLoadableModule import *
 import logging
-import numpy as np
 
-def getMatrixToACPC(ac, pc, ih):
-
-  # Anteroposterior axis
-  pcAc = ac - pc # Vector of acpc direction
-  yAxis = pcAc / np.linalg.norm(pcAc) # Unit vector of pcAc
-
-  # Lateral axis
-  acIhDir = ih - ac #  Vector in direction of ac ih
-  xAxis = np.cross(yAxis, acIhDir) # cross product, so it's x axis
-  xAxis /= np.linalg.norm(xAxis) # norm of x axis
-
-  # Rostrocaudal axis
-  zAxis = np.cross(xAxis, yAxis) #why? Because acIhDir isn't exactly z axis only
-
-  # Rotation matrix
-  rotation = np.vstack([xAxis, yAxis, zAxis])
-  # AC in rotated space
+# Slicer imports every scripted module at startup, and numpy alone costs ~100 ms of
+# import time (the numba probe pulls numpy in too). Defer both until the first Apply:
+# after _ensureComputeKernel() runs, np and getMatrixToACPC are module globals as before.
+np = None
+getMatrixToACPC = None
+
+def _ensureComputeKernel():
+  global np, getMatrixToACPC
+  if getMatrixToACPC is not None:
+    return
+  import numpy
+  np = numpy
+  # Numba isn't shipped with Slicer's Python, so treat it as optional: with it the
+  # kernel compiles to machine code (cached across sessions), without it the
+  # plain-Python body still runs correctly
+  try:
+    from numba import njit
+  except ImportError:
+    def njit(**kwargs):
+      def decorator(func):
+        return func
+      return decorator
+  getMatrixToACPC = njit(cache=True, fastmath=True)(_getMatrixToACPCImpl)
+
+def _getMatrixToACPCImpl(ac, pc, ih):
+  # Written entirely in scalar arithmetic (no np.cross / np.linalg.norm) so Numba
+  # can lower the whole function without any ufunc dispatch
+
+  # Anteroposterior axis: unit vector of the pc->ac direction
+  y0 = ac[0] - pc[0]
+  y1 = ac[1] - pc[1]
+  y2 = ac[2] - pc[2]
+  # The +1e-30 keeps the normalization branch-free when the points are degenerate
+  # (coincident AC/PC, or ih collinear with the AC-PC axis) instead of dividing by zero
+  yInv = 1.0 / (np.sqrt(y0*y0 + y1*y1 + y2*y2) + 1e-30)
+  y0 *= yInv
+  y1 *= yInv
+  y2 *= yInv
+
+  # Lateral axis: cross of yAxis with the ac->ih direction
+  d0 = ih[0] - ac[0]
+  d1 = ih[1] - ac[1]
+  d2 = ih[2] - ac[2]
+  x0 = y1*d2 - y2*d1
+  x1 = y2*d0 - y0*d2
+  x2 = y0*d1 - y1*d0
+  xInv = 1.0 / (np.sqrt(x0*x0 + x1*x1 + x2*x2) + 1e-30)
+  x0 *= xInv
+  x1 *= xInv
+  x2 *= xInv
+
+  # Rostrocaudal axis: cross of xAxis with yAxis (acIhDir isn't exactly z axis only)
+  z0 = x1*y2 - x2*y1
+  z1 = x2*y0 - x0*y2
+  z2 = x0*y1 - x1*y0
 
   # This code is changed from the script repository. The default code moves it to AC, whereas
-  # we want the origin to be at MCP. As such we need to offset it by half the pcAc distance
-  translation = -np.dot(rotation, ac - (np.dot(yAxis, 0.5*np.linalg.norm(pcAc))))
-
-  # This is the original code
-  # translation = -np.dot(rotation, ac) 
-
-  # Build homogeneous matrix
-  matrix = np.eye(4)
-  matrix[:3, :3] = rotation
-  matrix[:3, 3] = translation
+  # we want the origin to be at MCP, which is just the AC-PC midpoint
+  m0 = 0.5 * (ac[0] + pc[0])
+  m1 = 0.5 * (ac[1] + pc[1])
+  m2 = 0.5 * (ac[2] + pc[2])
+
+  # Homogeneous matrix, filled entry-by-entry into one allocation
+  matrix = np.zeros((4, 4))
+  matrix[0, 0] = x0
+  matrix[0, 1] = x1
+  matrix[0, 2] = x2
+  matrix[0, 3] = -(x0*m0 + x1*m1 + x2*m2)
+  matrix[1, 0] = y0
+  matrix[1, 1] = y1
+  matrix[1, 2] = y2
+  matrix[1, 3] = -(y0*m0 + y1*m1 + y2*m2)
+  matrix[2, 0] = z0
+  matrix[2, 1] = z1
+  matrix[2, 2] = z2
+  matrix[2, 3] = -(z0*m0 + z1*m1 + z2*m2)
+  matrix[3, 3] = 1.0
   return matrix
 
 
@@ -88,6 +135,8 @@ class acpcModule1Widget(ScriptedLoadableModuleWidget):
   def setup(self):
     ScriptedLoadableModuleWidget.setup(self)
 
+    self.logic = None
+
     # Instantiate and connect widgets ...
 
     #
@@ -133,7 +182,10 @@ class acpcModule1Widget(ScriptedLoadableModuleWidget):
     # output volume selector
     #
     self.outputSelector = slicer.qMRMLNodeComboBox()
-    self.outputSelector.nodeTypes = ["vtkMRMLTransformNode"]
+    # The ACPC transform is rigid (bottom row [0,0,0,1]), so offer linear transform
+    # nodes specifically; Slicer's resampler then takes the rigid fast path when
+    # the transform is hardened rather than treating it as a general warp
+    self.outputSelector.nodeTypes = ["vtkMRMLLinearTransformNode"]
     self.outputSelector.selectNodeUponCreation = True
     self.outputSelector.addEnabled = True
     self.outputSelector.removeEnabled = True
@@ -178,43 +230,75 @@ class acpcModule1Widget(ScriptedLoadableModuleWidget):
     self.applyButton.enabled = self.acpcSelector.currentNode() and self.volumeSelector.currentNode()
 
   def onApplyButton(self):
-    logic = myLogic()
-    logic.run(acpcFid = self.acpcSelector.currentNode(), volumeNode=self.volumeSelector.currentNode(), transformNode = self.outputSelector.currentNode(), autoHarden = self.enableAutoHarden.checked)
+    # Reuse one logic instance across clicks so its cached transform logic survives
+    if self.logic is None:
+      self.logic = myLogic()
+    self.logic.run(acpcFid = self.acpcSelector.currentNode(), volumeNode=self.volumeSelector.currentNode(), transformNode = self.outputSelector.currentNode(), autoHarden = self.enableAutoHarden.checked)
 
 class myLogic(ScriptedLoadableModuleLogic):
 
+  def __init__(self):
+    ScriptedLoadableModuleLogic.__init__(self)
+    self._transformLogic = None
+
   def run(self, acpcFid, volumeNode, transformNode, autoHarden=False):
 
-    # This is incredibly annoying and I don't know why it needs to be done this way but it does
-    # I tried running this using a loop, but I couldn't get it to work. 
-    for i in range(acpcFid.GetNumberOfFiducials()):
-      ras = [0,0,0]
-      acpcFid.GetNthFiducialPosition(i,ras)
-      if i == 0:
-        ac = np.array(ras)
-      if i == 1:
-        pc = np.array(ras)
-      if i == 2:
-        ih = np.array(ras)
-
-    # Translate the matrix to vtkMatrix
+    if transformNode is None:
+      return
+
+    _ensureComputeKernel()
+
+    # The algorithm needs exactly AC, PC, and a midline point
+    if acpcFid.GetNumberOfControlPoints() < 3:
+      logging.error('run failed: markup needs 3 control points (AC, PC, midline)')
+      return
+
+    # GetNthControlPointPosition is the current markups API (no deprecated-fiducial
+    # wrapper layer) and writes into any mutable length-3 sequence, so we can hand it
+    # rows of a preallocated array directly instead of going through a list and np.array().
+    # Note: keep the local (node) coordinates here, not the ...World variant — run() puts
+    # acpcFid under the output transform, so world coordinates would feed the already-
+    # transformed points back in on a repeat Apply
+    pts = np.empty((3, 3), dtype=np.float64)
+    acpcFid.GetNthControlPointPosition(0, pts[0])
+    acpcFid.GetNthControlPointPosition(1, pts[1])
+    acpcFid.GetNthControlPointPosition(2, pts[2])
+    ac, pc, ih = pts[0], pts[1], pts[2]
+
     matrix = getMatrixToACPC(ac, pc, ih)
-    vtkMatrix = vtk.vtkMatrix4x4()
-    for row in range(4):
-        for col in range(4):
-            vtkMatrix.SetElement(row, col, matrix[row, col])
-
-    # Apply transformation
-    transformNode.SetAndObserveMatrixTransformToParent(vtkMatrix)
-    
-    # Apply transform to volume node and markups node
-    acpcFid.SetAndObserveTransformNodeID(transformNode.GetID())
-    volumeNode.SetAndObserveTransformNodeID(transformNode.GetID())
-
-    if autoHarden:
-      logic = slicer.vtkSlicerTransformLogic()
-      logic.hardenTransform(acpcFid)
-      logic.hardenTransform(volumeNode)
+
+    # Everything below mutates the MRML scene: batch it so the views redraw once at
+    # EndState instead of once per modified event
+    wasModified = transformNode.StartModify()
+    slicer.mrmlScene.StartState(slicer.vtkMRMLScene.BatchProcessState)
+    try:
+      # Apply transformation. updateTransformMatrixFromArray (Slicer >= 4.11) pushes the
+      # numpy array into the transform node in a single C++ call; keep the DeepCopy path
+      # for older Slicer where the helper doesn't exist
+      if hasattr(slicer.util, 'updateTransformMatrixFromArray'):
+        slicer.util.updateTransformMatrixFromArray(transformNode, matrix)
+      else:
+        vtkMatrix = vtk.vtkMatrix4x4()
+        vtkMatrix.DeepCopy(matrix.ravel().tolist())
+        transformNode.SetAndObserveMatrixTransformToParent(vtkMatrix)
+
+      # Apply transform to volume node and markups node. Skip nodes already observing
+      # this transform so a repeat Apply doesn't fire a pointless MRML event cascade
+      tid = transformNode.GetID()
+      if acpcFid.GetTransformNodeID() != tid:
+        acpcFid.SetAndObserveTransformNodeID(tid)
+      if volumeNode.GetTransformNodeID() != tid:
+        volumeNode.SetAndObserveTransformNodeID(tid)
+
+      if autoHarden:
+        # Build the VTK logic object once and keep it for later applies
+        if self._transformLogic is None:
+          self._transformLogic = slicer.vtkSlicerTransformLogic()
+        self._transformLogic.hardenTransform(acpcFid)
+        self._transformLogic.hardenTransform(volumeNode)
+    finally:
+      slicer.mrmlScene.EndState(slicer.vtkMRMLScene.BatchProcessState)
+      transformNode.EndModify(wasModified)
 
 
 